@@ -1,12 +1,42 @@
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, FrozenSet, List, Tuple, Optional
 from dataclasses import dataclass
+from functools import cached_property, lru_cache
 from itertools import permutations
-from preprocessor import Graph, PlaceNode, Edge
+from preprocessor import Graph, PlaceNode, Edge, time_to_minutes
+import hashlib
 import json
+import logging
 import os
 
+logger = logging.getLogger(__name__)
 
-@dataclass
+# orjson parses JSON several times faster than the stdlib; fall back to
+# json transparently when it isn't installed
+try:
+    import orjson as _fast_json
+except ImportError:
+    _fast_json = None
+
+# Resolved once at import so every Engine instantiation reuses it
+_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+# Paths already warned about, so lazily-loaded configs that fall back to
+# defaults on every request warn once instead of flooding the log
+_warned_paths = set()
+
+
+@lru_cache(maxsize=None)
+def _load_json_cached(file_path: str, mtime: float):
+    """Parse a JSON file once per (path, mtime); edits invalidate the entry"""
+    # Read bytes and parse in one shot; text-mode json.load is slower
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if _fast_json is not None:
+        return _fast_json.loads(data)
+    return json.loads(data)
+
+
+@dataclass(slots=True)
 class SequenceResult:
     """Represents a sequence of places with total time and explanations"""
     sequence: List[str]  # List of place IDs
@@ -14,6 +44,37 @@ class SequenceResult:
     explanation: Dict[str, str]  # place_id -> explanation
 
 
+@dataclass(slots=True)
+class SequenceTrace:
+    """
+    Per-place data captured while walking a sequence once.
+    Lets explanation generation reuse the edge lookups, arrival times, and
+    preference matches instead of re-walking the graph for the chosen sequence.
+    """
+    arrival_times: List[float]  # arrival time at each place (minutes)
+    distances: List[float]  # distance of the edge into each place (km)
+    time_used_before: List[float]  # minutes elapsed before traveling to each place
+    matched_prefs: List[List[str]]  # preferences matched by each place
+    pref_scores: List[float]  # preference match score for each place
+    windows: List[Tuple[bool, Optional[str]]]  # preferred-window check per place
+    logical_reasons: List[Optional[str]]  # logical-sequence reason per edge (None for first)
+    total_time: float  # total sequence time including travel and visits
+
+
+@dataclass(frozen=True, slots=True)
+class Request:
+    """
+    User constraints compiled once per request (see Engine._compile_request).
+    Immutable and hashable, so it can take part in cache keys; hot paths read
+    attributes instead of repeating dict lookups and HH:MM parsing.
+    """
+    start_time_minutes: int
+    time_available_minutes: int
+    preferences: Optional[Tuple[str, ...]]  # None when the request has no preferences key
+    avoid: FrozenSet[str]  # lowercased avoid terms
+    avoid_crowded: bool  # True if the avoid list contains "crowded"
+
+
 class Engine:
     def __init__(self, weights: Dict[str, float] = None, weights_file: str = None,
                  mappings_file: str = None, times_file: str = None, sequences_file: str = None):
@@ -50,9 +111,11 @@ class Engine:
             "logical_sequence": 5  # bonus for logical ordering
         }
         
-        # Load weights from file (default to "default.json" if not specified)
+        # Load weights from file (default to "default.json" if not specified),
+        # merged over the defaults so all keys exist
         weights_file_to_load = weights_file if weights_file is not None else "default"
-        loaded_weights = self._load_weights_from_file(weights_file_to_load, default_weights)
+        loaded = self._load_json('weights', 'Weights', weights_file_to_load, None)
+        loaded_weights = default_weights if loaded is None else {**default_weights, **loaded}
         
         # Use provided weights dict (overrides file) or loaded weights
         if weights is not None:
@@ -61,184 +124,185 @@ class Engine:
         else:
             self.WEIGHTS = loaded_weights
         
-        # Load preference mappings from data/mappings/ directory
-        mappings_file_to_load = mappings_file if mappings_file is not None else "default"
-        self.PREFERENCE_MAPPINGS = self._load_mappings_from_file(mappings_file_to_load, {})
-        
-        # Load preferred times from data/times/ directory
-        times_file_to_load = times_file if times_file is not None else "default"
-        preferred_times_raw = self._load_times_from_file(times_file_to_load, {})
-        # Convert from JSON format to internal format (list of tuples)
-        self.PREFERRED_TIMES = {}
-        for place_type, windows in preferred_times_raw.items():
-            self.PREFERRED_TIMES[place_type] = [
+        # Mappings, times, and sequences are loaded lazily on first access
+        # (see the cached_property definitions below), so callers that only
+        # need constraint checks or sequence timing skip three JSON parses
+        self._mappings_file = mappings_file if mappings_file is not None else "default"
+        self._times_file = times_file if times_file is not None else "default"
+        self._sequences_file = sequences_file if sequences_file is not None else "default"
+
+        # Memoize the pure hot-path helpers: the same (type, preferences) and
+        # (type, time) keys recur across every scored permutation. Per-instance
+        # caches so engines with different configs don't share results.
+        # End-to-end result cache keyed by a stable digest of the request
+        # (user constraints plus the relevant place fields), so identical
+        # graphs processed repeatedly skip the whole filter+search pipeline
+        self._result_cache: Dict[Tuple[str, bytes], object] = {}
+
+        # Per-request sequence caches used by the _*_cached helpers inside
+        # the process* flows: the winning sequence is re-scored after the DP
+        # search and process_with_all_scores revisits identical sequences,
+        # so validity and scores are keyed on the ordered sequence tuple.
+        # Cleared at the start of each process* call; the keys ignore the
+        # graph and request, which is only sound within a single request, so
+        # the public is_sequence_valid/score_sequence stay uncached.
+        self._valid_cache: Dict[Tuple[Tuple[str, ...], bool], Tuple[bool, Optional[str]]] = {}
+        self._score_cache: Dict[Tuple[str, ...], float] = {}
+
+        self._preference_match = lru_cache(maxsize=None)(self._preference_match_impl)
+        self._matching_preferences = lru_cache(maxsize=None)(self._matching_preferences_impl)
+        self._prefs_for_type = lru_cache(maxsize=None)(self._prefs_for_type_impl)
+        self._preferred_window = lru_cache(maxsize=None)(self._preferred_window_impl)
+
+    @cached_property
+    def PREFERENCE_MAPPINGS(self) -> Dict[str, Tuple[str, ...]]:
+        """
+        Preference mappings, loaded from data/mappings/ on first access.
+        Keys and mapped types are lowercased once so hot loops never call .lower().
+        """
+        return {
+            key.lower(): tuple(mapped_type.lower() for mapped_type in value)
+            for key, value in self._load_json('mappings', 'Mappings', self._mappings_file, {}).items()
+        }
+
+    @cached_property
+    def PREFERRED_TIMES(self) -> Dict[str, Tuple[Tuple[int, int, str], ...]]:
+        """
+        Preferred time windows, loaded from data/times/ on first access and
+        converted from JSON format to the internal tuple-of-tuples format
+        (immutable and compact, since the hot path only ever scans them).
+        """
+        preferred_times_raw = self._load_json('times', 'Times', self._times_file, {})
+        return {
+            place_type: tuple(
                 (w["start_minutes"], w["end_minutes"], w["name"])
                 for w in windows
-            ]
-        
-        # Load logical sequences from data/sequences/ directory
-        sequences_file_to_load = sequences_file if sequences_file is not None else "default"
-        self.LOGICAL_SEQUENCES = self._load_sequences_from_file(sequences_file_to_load, [])
-    
-    def _get_data_dir(self) -> str:
-        """Get the data directory path"""
-        return os.path.join(os.path.dirname(__file__), 'data')
-    
-    def _load_mappings_from_file(self, mappings_file: str, default: Dict) -> Dict:
+            )
+            for place_type, windows in preferred_times_raw.items()
+        }
+
+    @cached_property
+    def _preferred_spans(self) -> Dict[str, Tuple[Tuple[int, int, str], ...]]:
         """
-        Load preference mappings from a JSON file.
-        
-        Args:
-            mappings_file: Path to mappings file or filename in data/mappings/ directory
-            default: Default mappings to use if file not found
-            
-        Returns:
-            Dictionary of preference mappings
+        PREFERRED_TIMES with each window's end replaced by its span on the
+        1440-minute ring, so the in-window test is a single branchless compare
+        with no overnight special case.
         """
-        # Determine full path
-        if os.path.isabs(mappings_file) or os.path.exists(mappings_file):
-            # Full path provided
-            file_path = mappings_file
-        else:
-            # Filename in data/mappings/ directory
-            filename = mappings_file if mappings_file.endswith('.json') else f"{mappings_file}.json"
-            data_dir = self._get_data_dir()
-            mappings_dir = os.path.join(data_dir, 'mappings')
-            file_path = os.path.join(mappings_dir, filename)
-        
-        # Load mappings from file
-        try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    return json.load(f)
-            else:
-                print(f"Warning: Mappings file not found: {file_path}. Using default.")
-                return default
-        except json.JSONDecodeError as e:
-            print(f"Warning: Invalid JSON in mappings file {file_path}: {e}. Using default.")
-            return default
-        except Exception as e:
-            print(f"Warning: Error loading mappings file {file_path}: {e}. Using default.")
-            return default
-    
-    def _load_times_from_file(self, times_file: str, default: Dict) -> Dict:
+        return {
+            place_type: tuple(
+                (start_min, (end_min - start_min) % 1440, window_name)
+                for start_min, end_min, window_name in windows
+            )
+            for place_type, windows in self.PREFERRED_TIMES.items()
+        }
+
+    @cached_property
+    def LOGICAL_SEQUENCES(self) -> List[Dict]:
+        """Logical sequence rules, loaded from data/sequences/ on first access"""
+        return self._load_json('sequences', 'Sequences', self._sequences_file, [])
+
+    @cached_property
+    def _logical_map(self) -> Dict[Tuple[str, str], str]:
         """
-        Load preferred times from a JSON file.
-        
-        Args:
-            times_file: Path to times file or filename in data/times/ directory
-            default: Default times to use if file not found
-            
-        Returns:
-            Dictionary of preferred times
+        Logical sequences indexed by (from_type, to_type) so the per-edge check
+        is one dict lookup instead of a linear scan with .lower() calls.
+        First matching rule wins, mirroring the original scan order.
         """
-        # Determine full path
-        if os.path.isabs(times_file) or os.path.exists(times_file):
-            # Full path provided
-            file_path = times_file
-        else:
-            # Filename in data/times/ directory
-            filename = times_file if times_file.endswith('.json') else f"{times_file}.json"
-            data_dir = self._get_data_dir()
-            times_dir = os.path.join(data_dir, 'times')
-            file_path = os.path.join(times_dir, filename)
-        
-        # Load times from file
-        try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    return json.load(f)
-            else:
-                print(f"Warning: Times file not found: {file_path}. Using default.")
-                return default
-        except json.JSONDecodeError as e:
-            print(f"Warning: Invalid JSON in times file {file_path}: {e}. Using default.")
-            return default
-        except Exception as e:
-            print(f"Warning: Error loading times file {file_path}: {e}. Using default.")
-            return default
-    
-    def _load_sequences_from_file(self, sequences_file: str, default: List) -> List[Dict]:
+        logical_map: Dict[Tuple[str, str], str] = {}
+        for seq_rule in self.LOGICAL_SEQUENCES:
+            key = (seq_rule.get("from_type", "").lower(), seq_rule.get("to_type", "").lower())
+            logical_map.setdefault(key, seq_rule.get("reason", "logical sequence"))
+        return logical_map
+
+    def _load_json(self, subdir: str, kind: str, name: str, default):
         """
-        Load logical sequences from a JSON file.
-        
+        Load a JSON config file from data/<subdir>/ (or a full path).
+
+        Parses are cached per (path, mtime) at module level, so repeated
+        Engine instantiations hit the cache instead of re-reading unchanged
+        files; editing a file still invalidates its entry.
+
         Args:
-            sequences_file: Path to sequences file or filename in data/sequences/ directory
-            default: Default sequences to use if file not found
-            
+            subdir: Subdirectory of the data directory (e.g., 'weights')
+            kind: Human-readable file kind for warning messages
+            name: Full path to a JSON file, or filename in data/<subdir>/
+                  (with or without the .json extension)
+            default: Value to return if the file is missing or invalid
+
         Returns:
-            List of sequence dictionaries
+            Parsed JSON content, or default on failure
         """
         # Determine full path
-        if os.path.isabs(sequences_file) or os.path.exists(sequences_file):
+        if os.path.isabs(name) or os.path.exists(name):
             # Full path provided
-            file_path = sequences_file
+            file_path = name
         else:
-            # Filename in data/sequences/ directory
-            filename = sequences_file if sequences_file.endswith('.json') else f"{sequences_file}.json"
-            data_dir = self._get_data_dir()
-            sequences_dir = os.path.join(data_dir, 'sequences')
-            file_path = os.path.join(sequences_dir, filename)
-        
-        # Load sequences from file
+            # Filename in data/<subdir>/ directory
+            filename = name if name.endswith('.json') else f"{name}.json"
+            file_path = os.path.join(_DATA_DIR, subdir, filename)
+
         try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    return json.load(f)
-            else:
-                print(f"Warning: Sequences file not found: {file_path}. Using default.")
-                return default
-        except json.JSONDecodeError as e:
-            print(f"Warning: Invalid JSON in sequences file {file_path}: {e}. Using default.")
+            return _load_json_cached(file_path, os.path.getmtime(file_path))
+        except FileNotFoundError:
+            if file_path not in _warned_paths:
+                _warned_paths.add(file_path)
+                logger.warning("%s file not found: %s. Using default.", kind, file_path)
+            return default
+        except ValueError as e:  # json.JSONDecodeError and orjson.JSONDecodeError
+            if file_path not in _warned_paths:
+                _warned_paths.add(file_path)
+                logger.warning("Invalid JSON in %s file %s: %s. Using default.", kind, file_path, e)
             return default
         except Exception as e:
-            print(f"Warning: Error loading sequences file {file_path}: {e}. Using default.")
+            if file_path not in _warned_paths:
+                _warned_paths.add(file_path)
+                logger.warning("Error loading %s file %s: %s. Using default.", kind, file_path, e)
             return default
-    
-    def _load_weights_from_file(self, weights_file: str, default_weights: Dict[str, float]) -> Dict[str, float]:
+
+    # Single memoized implementation lives in preprocessor; aliased here so
+    # the two parsers cannot drift apart
+    time_to_minutes = staticmethod(time_to_minutes)
+
+    def clear_cache(self) -> None:
+        """Drop all cached end-to-end results (e.g., between test scenarios)"""
+        self._result_cache.clear()
+
+    def _graph_digest(self, graph: Graph) -> bytes:
         """
-        Load weights from a JSON file.
-        
-        Args:
-            weights_file: Path to weights file or filename in data/weights/ directory
-            default_weights: Default weights to use if file not found
-            
-        Returns:
-            Dictionary of weights
+        Stable digest of everything that can influence a result: the user
+        constraints (including the start coordinates) and, per place, the
+        fields read by filtering, scoring, and sequencing. Each place's own
+        coordinates are part of the key — the start-row distance alone would
+        miss inter-place legs, letting graphs with different pairwise
+        geometry collide.
         """
-        # Determine full path
-        if os.path.isabs(weights_file) or os.path.exists(weights_file):
-            # Full path provided
-            file_path = weights_file
-        else:
-            # Filename in data/weights/ directory
-            # Remove .json extension if present
-            filename = weights_file if weights_file.endswith('.json') else f"{weights_file}.json"
-            data_dir = self._get_data_dir()
-            weights_dir = os.path.join(data_dir, 'weights')
-            file_path = os.path.join(weights_dir, filename)
-        
-        # Load weights from file
-        try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    loaded = json.load(f)
-                    # Merge with defaults to ensure all keys exist
-                    return {**default_weights, **loaded}
-            else:
-                print(f"Warning: Weights file not found: {file_path}. Using default weights.")
-                return default_weights
-        except json.JSONDecodeError as e:
-            print(f"Warning: Invalid JSON in weights file {file_path}: {e}. Using default weights.")
-            return default_weights
-        except Exception as e:
-            print(f"Warning: Error loading weights file {file_path}: {e}. Using default weights.")
-            return default_weights
+        payload = {
+            "user": graph.user_data,
+            "places": [
+                (
+                    place.id, place.type_lower, place.avg_duration_minutes,
+                    place.crowd_level, place.open_from_min, place.open_span_min,
+                    place.lat, place.lng,
+                )
+                for place in graph.nodes.values()
+            ],
+        }
+        return hashlib.blake2b(
+            json.dumps(payload, sort_keys=True).encode()
+        ).digest()
 
-    def time_to_minutes(self, time_str: str) -> int:
-        """Convert time string (HH:MM) to minutes since midnight"""
-        hours, minutes = map(int, time_str.split(":"))
-        return hours * 60 + minutes
+    def _compile_request(self, graph: Graph) -> Request:
+        """Compile the graph's user_data dict into a typed Request"""
+        user_data = graph.user_data
+        avoid = frozenset(term.lower() for term in user_data.get("avoid", ()))
+        preferences = user_data.get("preferences")
+        return Request(
+            start_time_minutes=graph.start_time_min,
+            time_available_minutes=user_data.get("time_available_minutes", 0),
+            preferences=tuple(preferences) if preferences is not None else None,
+            avoid=avoid,
+            avoid_crowded="crowded" in avoid
+        )
 
     def minutes_to_time(self, minutes: float) -> str:
         """Convert minutes since midnight to time string (HH:MM)"""
@@ -249,33 +313,26 @@ class Engine:
 
     def is_open_at_time(self, place: PlaceNode, arrival_time_minutes: int) -> bool:
         """Check if a place is open at the given arrival time"""
-        open_from = self.time_to_minutes(place.open_from)
-        open_to = self.time_to_minutes(place.open_to)
-        
-        # Handle places open past midnight (e.g., 22:00 to 04:00)
-        if open_to < open_from:
-            # Place is open overnight
-            return arrival_time_minutes >= open_from or arrival_time_minutes <= open_to
-        else:
-            return open_from <= arrival_time_minutes <= open_to
+        # Branchless check on the 1440-minute ring: in-window iff the offset
+        # from opening lies within the precomputed span. Handles overnight
+        # windows (e.g., 22:00 to 04:00) without a special case.
+        return (arrival_time_minutes - place.open_from_min) % 1440 <= place.open_span_min
 
-    def passes_hard_constraints(self, place: PlaceNode, user_data: Dict, 
+    def passes_hard_constraints(self, place: PlaceNode, req: Request,
                                 arrival_time_minutes: int, strict_avoid: bool = True) -> bool:
         """
         Check if a place passes all hard constraints
-        
+
         Args:
             place: Place to check
-            user_data: User data with constraints
+            req: Compiled request constraints
             arrival_time_minutes: Arrival time in minutes
             strict_avoid: If False, skip avoid list check (fallback mode)
         """
         # Check avoid list (only if strict_avoid is True)
-        if strict_avoid and "avoid" in user_data:
-            for avoid_term in user_data["avoid"]:
-                if avoid_term.lower() == "crowded" and place.crowd_level == "high":
-                    return False
-        
+        if strict_avoid and req.avoid_crowded and place.crowd_level == "high":
+            return False
+
         # Check opening hours
         if not self.is_open_at_time(place, arrival_time_minutes):
             return False
@@ -291,60 +348,96 @@ class Engine:
         """
         if not preferences:
             return 0.5  # Neutral score if no preferences
-        
-        place_type_lower = place.type.lower()
-        match_count = 0
-        
-        for preference in preferences:
-            preference_lower = preference.lower()
-            
-            # Direct type match
-            if preference_lower == place_type_lower:
-                match_count += 1
-                continue
-            
-            # Check preference mappings
-            if preference_lower in self.PREFERENCE_MAPPINGS:
-                mapped_types = self.PREFERENCE_MAPPINGS[preference_lower]
-                if any(mapped_type in place_type_lower for mapped_type in mapped_types):
-                    match_count += 1
-        
-        # Return simple ratio: matches / total preferences
-        return match_count / len(preferences)
 
-    def score_place(self, place: PlaceNode, user_data: Dict, 
+        # Delegate to the memoized helper on a hashable (type, preferences) key
+        return self._preference_match(place.type_lower, tuple(preferences))
+
+    def _preference_match_impl(self, place_type_lower: str, preferences: Tuple[str, ...]) -> float:
+        """Uncached preference matching; wrapped with lru_cache in __init__"""
+        # Each preference contributes at most one match, so the ratio is just
+        # the matching-preference count over the total
+        return len(self._matching_preferences(place_type_lower, preferences)) / len(preferences)
+
+    def _matching_preferences_impl(self, place_type_lower: str,
+                                   preferences: Tuple[str, ...]) -> Tuple[str, ...]:
+        """
+        Which of the given preferences this place type matches (directly or via
+        the preference mappings), in preference order and original casing.
+        Wrapped with lru_cache in __init__; shared by scoring and explanations
+        so the match logic runs once per distinct (type, preferences) pair.
+        """
+        mapped_prefs = self._prefs_for_type(place_type_lower)
+        return tuple(
+            preference for preference in preferences
+            # Direct type match, or a preference-mapping hit via the reverse index
+            if preference.lower() == place_type_lower or preference.lower() in mapped_prefs
+        )
+
+    def _prefs_for_type_impl(self, place_type_lower: str) -> FrozenSet[str]:
+        """
+        Reverse index over the preference mappings: the mapping keys whose
+        mapped tokens occur in this place type. The substring scan over every
+        mapping runs once per distinct type (wrapped with lru_cache in
+        __init__); after that, preference matching is set membership.
+        """
+        return frozenset(
+            pref_key for pref_key, mapped_types in self.PREFERENCE_MAPPINGS.items()
+            if any(mapped_type in place_type_lower for mapped_type in mapped_types)
+        )
+
+    def score_place(self, place: PlaceNode, req: Request,
                    distance_from_start_km: float, current_time_minutes: int) -> float:
         """
         Score a place based on preferences, distance, and other factors.
         Higher score = better place.
         """
-        score = 0.0
-        
-        # Preference matching
-        if "preferences" in user_data:
-            preference_score = self.matches_preferences(place, user_data["preferences"])
-            score += preference_score * self.WEIGHTS["preference_match"]
-        
-        # Distance penalty (closer is better)
-        score += distance_from_start_km * self.WEIGHTS["distance_penalty"]
-        
-        # Crowd penalty (if avoiding crowded)
-        if "avoid" in user_data and "crowded" in user_data["avoid"]:
-            if place.crowd_level == "high":
-                score += self.WEIGHTS["crowd_penalty"]
-            elif place.crowd_level == "low":
-                score += abs(self.WEIGHTS["crowd_penalty"]) * 0.5  # Bonus for low crowd
-        
-        # Time efficiency (bonus if place fits well in remaining time)
-        time_available = user_data.get("time_available_minutes", 0)
-        time_used = current_time_minutes - self.time_to_minutes(user_data.get("start_time", "00:00"))
-        time_remaining = time_available - time_used
-        
-        if place.avg_duration_minutes <= time_remaining:
-            efficiency = place.avg_duration_minutes / max(time_remaining, 1)
-            score += (1 - efficiency) * self.WEIGHTS["time_efficiency"]  # Better if uses time well
-        
-        return score
+        return self._score_place_kernel(place, req, distance_from_start_km, current_time_minutes)
+
+    @cached_property
+    def _score_place_kernel(self):
+        """
+        Per-place scoring kernel specialized against this engine's weights.
+
+        WEIGHTS never changes after __init__, so the weight values (and the
+        derived low-crowd bonus) are bound into a closure once on first use;
+        the hot loop then reads constants from the closure cells instead of
+        doing five dict lookups per scored place.
+        """
+        w_preference = self.WEIGHTS["preference_match"]
+        w_distance = self.WEIGHTS["distance_penalty"]
+        w_crowd = self.WEIGHTS["crowd_penalty"]
+        w_time = self.WEIGHTS["time_efficiency"]
+        low_crowd_bonus = abs(w_crowd) * 0.5
+        matches_preferences = self.matches_preferences
+
+        def kernel(place: PlaceNode, req: Request,
+                   distance_from_start_km: float, current_time_minutes: int) -> float:
+            score = 0.0
+
+            # Preference matching
+            if req.preferences is not None:
+                score += matches_preferences(place, req.preferences) * w_preference
+
+            # Distance penalty (closer is better)
+            score += distance_from_start_km * w_distance
+
+            # Crowd penalty (if avoiding crowded)
+            if req.avoid_crowded:
+                if place.crowd_level == "high":
+                    score += w_crowd
+                elif place.crowd_level == "low":
+                    score += low_crowd_bonus  # Bonus for low crowd
+
+            # Time efficiency (bonus if place fits well in remaining time)
+            time_remaining = req.time_available_minutes - (current_time_minutes - req.start_time_minutes)
+
+            if place.avg_duration_minutes <= time_remaining:
+                efficiency = place.avg_duration_minutes / max(time_remaining, 1)
+                score += (1 - efficiency) * w_time  # Better if uses time well
+
+            return score
+
+        return kernel
 
     def calculate_sequence_time(self, sequence: List[str], graph: Graph, 
                                start_time_minutes: int) -> Tuple[float, List[int]]:
@@ -352,70 +445,81 @@ class Engine:
         Calculate total time for a sequence including travel and visit times.
         Returns (total_time, arrival_times)
         """
+        # Hoist lookups out of the loop; this runs once per scored permutation.
+        # Travel times come straight from the dense matrix rows ("start" is
+        # row 0), so each leg is two list indexes instead of dict lookups,
+        # and the running sum doubles as the arrival-time prefix sums.
+        nodes = graph.nodes
+        travel_min = graph.travel_min
         current_time = start_time_minutes
         arrival_times = [current_time]  # Start time
-        
-        for i, place_id in enumerate(sequence):
-            place = graph.nodes[place_id]
-            
-            # Add travel time (from previous location)
-            if i == 0:
-                # Travel from start
-                edge = next(e for e in graph.edges["start"] if e.to_node == place_id)
-            else:
-                # Travel from previous place
-                prev_place_id = sequence[i - 1]
-                edge = next(e for e in graph.edges[prev_place_id] if e.to_node == place_id)
-            
-            current_time += edge.travel_time_minutes
-            arrival_times.append(int(current_time))
-            
-            # Add visit duration
+        record_arrival = arrival_times.append
+        travel_row = travel_min[0]
+
+        for place_id in sequence:
+            # Travel from previous location, then visit
+            place = nodes[place_id]
+            current_time += travel_row[place.int_id]
+            record_arrival(int(current_time))
             current_time += place.avg_duration_minutes
-        
+            travel_row = travel_min[place.int_id]
+
         total_time = current_time - start_time_minutes
         return total_time, arrival_times
 
-    def is_sequence_valid(self, sequence: List[str], graph: Graph, 
-                         user_data: Dict, is_fallback: bool = False) -> Tuple[bool, Optional[str]]:
+    def is_sequence_valid(self, sequence: List[str], graph: Graph,
+                         req: Request, is_fallback: bool = False) -> Tuple[bool, Optional[str]]:
         """
         Check if a sequence is valid (all constraints satisfied).
         Returns (is_valid, error_message)
-        
+
         Args:
             sequence: List of place IDs
             graph: Graph object
-            user_data: User data with constraints
+            req: Compiled request constraints
             is_fallback: If True, allow slight time budget overage (5% tolerance)
         """
-        start_time_minutes = self.time_to_minutes(user_data.get("start_time", "00:00"))
-        time_available = user_data.get("time_available_minutes", 0)
-        
-        # Calculate total time
-        total_time, arrival_times = self.calculate_sequence_time(sequence, graph, start_time_minutes)
-        
-        # Check time budget (with tolerance in fallback mode)
+        start_time_minutes = req.start_time_minutes
+        time_available = req.time_available_minutes
         time_tolerance = time_available * 0.05 if is_fallback else 0  # 5% tolerance in fallback
-        if total_time > time_available + time_tolerance:
-            return False, f"Sequence exceeds time budget ({total_time:.1f} > {time_available} minutes)"
-        
-        # Check each place's constraints
-        for i, place_id in enumerate(sequence):
-            place = graph.nodes[place_id]
-            arrival_time = int(arrival_times[i + 1])  # +1 because first is start time
-            
+        deadline = time_available + time_tolerance
+        strict_avoid = not is_fallback
+
+        # Walk the sequence once, checking each place as its arrival time is
+        # computed. Elapsed time only grows, so any violation rejects the
+        # sequence immediately instead of finishing the time accumulation
+        # first; most invalid permutations fail on their first place.
+        nodes = graph.nodes
+        travel_min = graph.travel_min
+        current_time = start_time_minutes
+        travel_row = travel_min[0]
+
+        for place_id in sequence:
+            place = nodes[place_id]
+            leg_travel = travel_row[place.int_id]
+            arrival_time = int(current_time + leg_travel)
+
             # Check opening hours
             if not self.is_open_at_time(place, arrival_time):
                 return False, f"{place.name} is not open at arrival time {self.minutes_to_time(arrival_time)}"
-            
+
             # Check hard constraints (skip avoid list check in fallback mode)
-            if not self.passes_hard_constraints(place, user_data, arrival_time, strict_avoid=not is_fallback):
+            if not self.passes_hard_constraints(place, req, arrival_time, strict_avoid=strict_avoid):
                 return False, f"{place.name} violates hard constraints"
-        
+
+            # Check time budget (with tolerance in fallback mode); already-over
+            # prefixes can't recover, so no need to walk the rest
+            current_time += leg_travel + place.avg_duration_minutes
+            elapsed = current_time - start_time_minutes
+            if elapsed > deadline:
+                return False, f"Sequence exceeds time budget ({elapsed:.1f} > {time_available} minutes)"
+
+            travel_row = travel_min[place.int_id]
+
         return True, None
 
-    def score_sequence(self, sequence: List[str], graph: Graph, 
-                      user_data: Dict) -> float:
+    def score_sequence(self, sequence: List[str], graph: Graph,
+                      req: Request) -> float:
         """
         Score a sequence based on time-of-day appropriateness, distance, and logical flow.
         Higher score = better sequence.
@@ -426,165 +530,222 @@ class Engine:
         - Logical flow (e.g., park before cafe)
         """
         score = 0.0
-        start_time_minutes = self.time_to_minutes(user_data.get("start_time", "00:00"))
-        
-        # Score each place in the sequence
+        start_time_minutes = req.start_time_minutes
+
+        # Hoist lookups; this is the hot loop run once per candidate
+        # permutation. Leg metrics come from the dense matrix rows ("start"
+        # is row 0) instead of Edge objects.
+        nodes = graph.nodes
+        dist_km = graph.dist_km
+        travel_min = graph.travel_min
         current_time = start_time_minutes
         total_distance = 0
-        
-        for i, place_id in enumerate(sequence):
-            place = graph.nodes[place_id]
-            
-            # Calculate distance from previous location
-            if i == 0:
-                edge = next(e for e in graph.edges["start"] if e.to_node == place_id)
-                distance_km = edge.distance_km
-            else:
-                prev_place_id = sequence[i - 1]
-                edge = next(e for e in graph.edges[prev_place_id] if e.to_node == place_id)
-                distance_km = edge.distance_km
-            
-            total_distance += distance_km
-            
+        prev_place = None
+        dist_row = dist_km[0]
+        travel_row = travel_min[0]
+
+        for place_id in sequence:
+            place = nodes[place_id]
+            j = place.int_id
+
+            # Distance from previous location
+            leg_distance = dist_row[j]
+            leg_travel = travel_row[j]
+            total_distance += leg_distance
+
             # Calculate arrival time at this place
-            arrival_time = current_time + edge.travel_time_minutes
-            
-            # Time-of-day appropriateness bonus
-            is_preferred, window_name = self.is_time_in_preferred_window(place.type, arrival_time)
+            arrival_time = current_time + leg_travel
+
+            # Time-of-day appropriateness bonus (memoized check keyed on the
+            # precomputed lowercase type; no per-call .lower() allocation)
+            is_preferred, window_name = self._preferred_window(place.type_lower, arrival_time)
             if is_preferred and window_name:
                 # Bonus for visiting at preferred time (e.g., cafe during breakfast)
                 score += self.WEIGHTS.get("time_efficiency", 3) * 1.5  # Extra bonus for preferred time
-            
+
             # Score this place (includes preference, distance, etc.)
-            place_score = self.score_place(place, user_data, distance_km, current_time)
+            place_score = self.score_place(place, req, leg_distance, current_time)
             score += place_score
-            
+
             # Update current time
-            current_time += edge.travel_time_minutes + place.avg_duration_minutes
-            
-            # Logical sequence bonus (check all configured sequences)
-            if i > 0:
-                prev_place = graph.nodes[sequence[i - 1]]
-                prev_type = prev_place.type.lower()
-                curr_type = place.type.lower()
-                
-                # Check if this sequence matches any configured logical sequence
-                for seq_rule in self.LOGICAL_SEQUENCES:
-                    if (seq_rule.get("from_type", "").lower() == prev_type and 
-                        seq_rule.get("to_type", "").lower() == curr_type):
-                        score += self.WEIGHTS["logical_sequence"]
-                        break  # Only apply bonus once per sequence
+            current_time += leg_travel + place.avg_duration_minutes
+
+            # Logical sequence bonus (applied once per matching edge)
+            if prev_place is not None and (prev_place.type_lower, place.type_lower) in self._logical_map:
+                score += self.WEIGHTS["logical_sequence"]
+
+            prev_place = place
+            dist_row = dist_km[j]
+            travel_row = travel_min[j]
         
         # Distance efficiency penalty (shorter total distance is better)
         score -= total_distance * abs(self.WEIGHTS.get("distance_penalty", -2))  # Penalty for total distance
         
         return score
 
-    def generate_explanations(self, sequence: List[str], graph: Graph, 
-                             user_data: Dict, is_fallback: bool = False) -> Dict[str, str]:
+    def _is_sequence_valid_cached(self, sequence, graph: Graph, req: Request,
+                                  is_fallback: bool = False) -> Tuple[bool, Optional[str]]:
+        """
+        is_sequence_valid behind the per-request cache. The key is just the
+        sequence tuple and fallback flag, so this is only valid within one
+        process* call, where the graph and request are fixed and the cache
+        was cleared on entry.
+        """
+        key = (tuple(sequence), is_fallback)
+        result = self._valid_cache.get(key)
+        if result is None:
+            result = self.is_sequence_valid(sequence, graph, req, is_fallback=is_fallback)
+            self._valid_cache[key] = result
+        return result
+
+    def _score_sequence_cached(self, sequence, graph: Graph, req: Request) -> float:
+        """score_sequence behind the per-request cache (see _is_sequence_valid_cached)"""
+        key = tuple(sequence)
+        score = self._score_cache.get(key)
+        if score is None:
+            score = self.score_sequence(sequence, graph, req)
+            self._score_cache[key] = score
+        return score
+
+    def _trace_sequence(self, sequence: List[str], graph: Graph, req: Request) -> SequenceTrace:
+        """
+        Walk a sequence once and capture everything explanation generation
+        needs: edge distances, arrival times, preference matches, preferred
+        windows, and logical-sequence reasons.
+        """
+        preferences = req.preferences or ()
+        start_time_minutes = req.start_time_minutes
+        nodes = graph.nodes
+        dist_km = graph.dist_km
+        travel_min = graph.travel_min
+
+        arrival_times = []
+        distances = []
+        time_used_before = []
+        matched_prefs = []
+        pref_scores = []
+        windows = []
+        logical_reasons = []
+
+        current_time = start_time_minutes
+        prev_place = None
+        dist_row = dist_km[0]
+        travel_row = travel_min[0]
+
+        for place_id in sequence:
+            place = nodes[place_id]
+            j = place.int_id
+            leg_travel = travel_row[j]
+
+            distances.append(dist_row[j])
+            time_used_before.append(current_time - start_time_minutes)
+
+            arrival_time = current_time + leg_travel
+            arrival_times.append(arrival_time)
+            windows.append(self._preferred_window(place.type_lower, arrival_time))
+
+            # Which preferences does this place match?
+            if preferences:
+                pref_scores.append(self.matches_preferences(place, preferences))
+                matched_prefs.append(
+                    list(self._matching_preferences(place.type_lower, tuple(preferences))))
+            else:
+                pref_scores.append(0.5)
+                matched_prefs.append([])
+
+            # Logical sequence (first matching configured rule)
+            if prev_place is not None:
+                logical_reasons.append(self._logical_map.get((prev_place.type_lower, place.type_lower)))
+            else:
+                logical_reasons.append(None)
+
+            current_time += leg_travel + place.avg_duration_minutes
+            prev_place = place
+            dist_row = dist_km[j]
+            travel_row = travel_min[j]
+
+        return SequenceTrace(
+            arrival_times=arrival_times,
+            distances=distances,
+            time_used_before=time_used_before,
+            matched_prefs=matched_prefs,
+            pref_scores=pref_scores,
+            windows=windows,
+            logical_reasons=logical_reasons,
+            total_time=current_time - start_time_minutes
+        )
+
+    def generate_explanations(self, sequence: List[str], graph: Graph,
+                             req: Request, is_fallback: bool = False,
+                             trace: SequenceTrace = None) -> Dict[str, str]:
         """
         Generate explanations for why each place was chosen in this order
-        
+
         Args:
             sequence: List of place IDs in order
             graph: Graph object
-            user_data: User preferences and constraints
+            req: Compiled request constraints
             is_fallback: If True, indicates avoid list was relaxed
+            trace: Optional precomputed SequenceTrace for this sequence; if
+                   omitted, the sequence is walked once to build it
         """
+        if trace is None:
+            trace = self._trace_sequence(sequence, graph, req)
+
         explanations = {}
-        start_time_minutes = self.time_to_minutes(user_data.get("start_time", "00:00"))
-        preferences = user_data.get("preferences", [])
-        avoid = user_data.get("avoid", [])
-        
+        preferences = req.preferences or ()
+        time_available = req.time_available_minutes
+
         # Add fallback note if applicable
         if is_fallback:
             explanations["_fallback"] = "No places matching all constraints found; showing best available options"
-        
-        current_time = start_time_minutes
-        
+
         for i, place_id in enumerate(sequence):
             place = graph.nodes[place_id]
             reasons = []
-            
+
             # Preference match
-            if preferences:
-                pref_match = self.matches_preferences(place, preferences)
-                if pref_match > 0.5:
-                    # Find all matching preferences
-                    matching_prefs = []
-                    for p in preferences:
-                        preference_lower = p.lower()
-                        place_type_lower = place.type.lower()
-                        
-                        # Direct type match
-                        if preference_lower == place_type_lower:
-                            matching_prefs.append(p)
-                        # Check preference mappings
-                        elif preference_lower in self.PREFERENCE_MAPPINGS:
-                            mapped_types = self.PREFERENCE_MAPPINGS[preference_lower]
-                            if any(mapped_type in place_type_lower for mapped_type in mapped_types):
-                                matching_prefs.append(p)
-                    
-                    if matching_prefs:
-                        if len(matching_prefs) == 1:
-                            reasons.append(f"matches preference for '{matching_prefs[0]}'")
-                        else:
-                            reasons.append(f"matches preferences: '{', '.join(matching_prefs)}'")
-            
+            if preferences and trace.pref_scores[i] > 0.5:
+                matching_prefs = trace.matched_prefs[i]
+                if matching_prefs:
+                    if len(matching_prefs) == 1:
+                        reasons.append(f"matches preference for '{matching_prefs[0]}'")
+                    else:
+                        reasons.append(f"matches preferences: '{', '.join(matching_prefs)}'")
+
             # Crowd level
-            if avoid and "crowded" in avoid:
+            if req.avoid_crowded:
                 if place.crowd_level == "low":
                     reasons.append("low crowd level")
                 elif place.crowd_level == "high" and is_fallback:
                     reasons.append("note: crowded (best available option)")
             elif place.crowd_level == "low":
                 reasons.append("quiet atmosphere")
-            
+
             # Distance
-            if i == 0:
-                edge = next(e for e in graph.edges["start"] if e.to_node == place_id)
-            else:
-                prev_place_id = sequence[i - 1]
-                edge = next(e for e in graph.edges[prev_place_id] if e.to_node == place_id)
-            
-            if edge.distance_km < 0.2:
+            if trace.distances[i] < 0.2:
                 reasons.append("nearby")
-            
+
             # Time of day and preferred time window
-            arrival_time = current_time + edge.travel_time_minutes
-            arrival_str = self.minutes_to_time(arrival_time)
-            is_preferred, window_name = self.is_time_in_preferred_window(place.type, arrival_time)
+            arrival_str = self.minutes_to_time(trace.arrival_times[i])
+            is_preferred, window_name = trace.windows[i]
             if is_preferred and window_name:
                 reasons.append(f"ideal time ({window_name}) at {arrival_str}")
             elif i == 0:
                 reasons.append(f"accessible at {arrival_str}")
-            
-            # Logical sequence (check all configured sequences)
-            if i > 0:
-                prev_place = graph.nodes[sequence[i - 1]]
-                prev_type = prev_place.type.lower()
-                curr_type = place.type.lower()
-                
-                # Check if this sequence matches any configured logical sequence
-                for seq_rule in self.LOGICAL_SEQUENCES:
-                    if (seq_rule.get("from_type", "").lower() == prev_type and 
-                        seq_rule.get("to_type", "").lower() == curr_type):
-                        reason = seq_rule.get("reason", "logical sequence")
-                        reasons.append(reason)
-                        break  # Only add one reason per sequence
-            
+
+            # Logical sequence (first matching configured rule)
+            if trace.logical_reasons[i] is not None:
+                reasons.append(trace.logical_reasons[i])
+
             # Duration fit
-            time_available = user_data.get("time_available_minutes", 0)
-            time_used = current_time - start_time_minutes
-            time_remaining = time_available - time_used
+            time_remaining = time_available - trace.time_used_before[i]
             if place.avg_duration_minutes <= time_remaining:
                 reasons.append(f"fits remaining time ({time_remaining:.0f} min)")
-            
+
             explanation = ", ".join(reasons) if reasons else "selected based on constraints"
             explanations[place_id] = explanation.capitalize()
-            
-            current_time += edge.travel_time_minutes + place.avg_duration_minutes
-        
+
         return explanations
 
     def is_time_in_preferred_window(self, place_type: str, time_minutes: int) -> Tuple[bool, Optional[str]]:
@@ -598,22 +759,20 @@ class Engine:
         Returns:
             (is_preferred, window_name) - True if time is in preferred window, and the window name
         """
-        place_type_lower = place_type.lower()
-        
-        if place_type_lower not in self.PREFERRED_TIMES:
+        # Delegate to the memoized helper on a hashable (type, time) key
+        return self._preferred_window(place_type.lower(), time_minutes)
+
+    def _preferred_window_impl(self, place_type_lower: str, time_minutes: int) -> Tuple[bool, Optional[str]]:
+        """Uncached preferred-window check; wrapped with lru_cache in __init__"""
+        windows = self._preferred_spans.get(place_type_lower)
+        if windows is None:
             return True, None  # No preferred times defined, consider it always suitable
-        
-        for start_min, end_min, window_name in self.PREFERRED_TIMES[place_type_lower]:
-            # Handle overnight windows (e.g., 20:00 to 02:00)
-            if end_min < start_min:
-                # Overnight window
-                if time_minutes >= start_min or time_minutes <= end_min:
-                    return True, window_name
-            else:
-                # Normal window
-                if start_min <= time_minutes <= end_min:
-                    return True, window_name
-        
+
+        for start_min, span_min, window_name in windows:
+            # Ring check covers normal and overnight windows alike
+            if (time_minutes - start_min) % 1440 <= span_min:
+                return True, window_name
+
         return False, None
     
     def filter_candidates(self, graph: Graph, strict_avoid: bool = True) -> Tuple[List[str], bool]:
@@ -634,81 +793,269 @@ class Engine:
         Returns:
             Tuple of (candidate place IDs, is_fallback) where is_fallback indicates if avoid list was relaxed
         """
-        user_data = graph.user_data
-        start_time_minutes = self.time_to_minutes(user_data.get("start_time", "00:00"))
-        time_available = user_data.get("time_available_minutes", 0)
-        preferences = user_data.get("preferences", [])
-        avoid = user_data.get("avoid", [])
-        
+        req = self._compile_request(graph)
+
         # First pass: collect all valid places with their scores
+        valid_places = self.score_places(graph, req, strict_avoid)
+        
+        # Second pass: deduplicate by place type - keep only the best one of
+        # each type (highest score, closest as tiebreaker). A running
+        # best-per-type with the same (-score, distance) key replaces the old
+        # group-then-sort, so no per-type lists are built or sorted; strict
+        # less-than keeps the earlier place on exact ties like the stable
+        # sort did.
+        best_by_type = {}  # {type_code: ((-score, distance), place_id)}
+        for place_id, place, score, distance in valid_places:
+            key = (-score, distance)
+            type_code = place.type_code
+            current = best_by_type.get(type_code)
+            if current is None or key < current[0]:
+                best_by_type[type_code] = (key, place_id)
+
+        candidates = [place_id for _, place_id in best_by_type.values()]
+        return candidates, not strict_avoid
+
+    def score_places(self, graph: Graph, req: Request,
+                     strict_avoid: bool = True) -> List[Tuple[str, PlaceNode, float, float]]:
+        """
+        Filter and score every place in one pass over the graph.
+
+        Applies the hard constraints (avoid list when strict_avoid, opening
+        hours at the estimated arrival, time budget, preference match) and
+        scores the survivors for candidate ranking. Distances and travel
+        times come from row 0 of the dense matrices, and all per-request
+        values are hoisted out of the loop, so each place costs a handful of
+        local reads rather than dict and attribute chasing.
+
+        Returns a list of (place_id, place, score, distance_km) tuples.
+        """
+        start_time_minutes = req.start_time_minutes
+        time_available = req.time_available_minutes
+        preferences = req.preferences or ()
+        avoid_crowded = req.avoid_crowded
+        skip_high_crowd = strict_avoid and avoid_crowded
+        penalize_high_crowd = avoid_crowded and not strict_avoid
+
+        start_dist = graph.dist_km[0]
+        start_travel = graph.travel_from_start
+        # The (type, preferences) cache acts as the per-request match table:
+        # preferences is a fixed tuple here, so every distinct place type
+        # computes its match once and every other place of that type is a
+        # dict hit, with no wrapper call or tuple rebuild per place
+        preference_match = self._preference_match
+
         valid_places = []  # List of (place_id, place, score, distance)
-        
         for place_id, place in graph.nodes.items():
-            # Get distance from start
-            edge = next(e for e in graph.edges["start"] if e.to_node == place_id)
-            estimated_arrival = start_time_minutes + edge.travel_time_minutes
-            distance_km = edge.distance_km
-            
+            travel_time = start_travel[place.int_id]
+
             # Check avoid list (only if strict_avoid is True)
-            if strict_avoid:
-                skip_place = False
-                if avoid:
-                    for avoid_term in avoid:
-                        if avoid_term.lower() == "crowded" and place.crowd_level == "high":
-                            skip_place = True
-                            break
-                if skip_place:
-                    continue
-            
-            # Check opening hours (hard constraint)
-            if not self.is_open_at_time(place, estimated_arrival):
+            if skip_high_crowd and place.crowd_level == "high":
                 continue
-            
+
+            # Check opening hours (hard constraint); ring check inlined from
+            # is_open_at_time to drop a method call per place
+            if (start_time_minutes + travel_time - place.open_from_min) % 1440 > place.open_span_min:
+                continue
+
             # Check time budget (hard constraint)
-            if place.avg_duration_minutes + edge.travel_time_minutes > time_available:
+            if place.avg_duration_minutes + travel_time > time_available:
                 continue
-            
-            # Check preferences (must match at least one preference)
-            if preferences:
-                pref_match = self.matches_preferences(place, preferences)
-                if pref_match == 0:
-                    continue  # Doesn't match any preference, skip
-            
+
             # Score this place for ranking (prefer closer, better matches, lower crowd)
             score = 0.0
             if preferences:
+                # Must match at least one preference (hard constraint)
+                pref_match = preference_match(place.type_lower, preferences)
+                if pref_match == 0:
+                    continue
                 score += pref_match * 10  # Preference match bonus
+            distance_km = start_dist[place.int_id]
             score -= distance_km * 2  # Distance penalty (closer is better)
-            if avoid and "crowded" in avoid:
+            if avoid_crowded:
                 if place.crowd_level == "low":
                     score += 5  # Bonus for low crowd
-                elif place.crowd_level == "high" and not strict_avoid:
+                elif penalize_high_crowd and place.crowd_level == "high":
                     score -= 5  # Penalty for high crowd in fallback mode
-            
+
             # Place passes all filters - add to valid places
             valid_places.append((place_id, place, score, distance_km))
-        
-        # Second pass: deduplicate by place type - keep only the best one of each type
-        # Group by place type
-        places_by_type = {}  # {place_type: [(place_id, place, score, distance), ...]}
-        
-        for place_id, place, score, distance in valid_places:
-            place_type = place.type.lower()
-            if place_type not in places_by_type:
-                places_by_type[place_type] = []
-            places_by_type[place_type].append((place_id, place, score, distance))
-        
-        # For each type, keep only the best one (highest score, or if tie, closest)
-        candidates = []
-        for place_type, places_list in places_by_type.items():
-            # Sort by score (descending), then by distance (ascending) as tiebreaker
-            places_list.sort(key=lambda x: (-x[2], x[3]))
-            # Keep only the best one
-            best_place_id = places_list[0][0]
-            candidates.append(best_place_id)
-        
-        return candidates, not strict_avoid
-    
+
+        return valid_places
+
+    def _score_step(self, prev_place: Optional[PlaceNode], place: PlaceNode, distance_km: float,
+                    travel_time_minutes: float, current_time: float, req: Request) -> float:
+        """
+        Score the extension of a partial sequence by one place, departing from
+        prev_place (None when leaving the start) at current_time. Mirrors one
+        iteration of score_sequence, including the per-edge share of the total
+        distance penalty.
+        """
+        delta = 0.0
+        arrival_time = current_time + travel_time_minutes
+
+        # Time-of-day appropriateness bonus
+        is_preferred, window_name = self._preferred_window(place.type_lower, arrival_time)
+        if is_preferred and window_name:
+            delta += self.WEIGHTS.get("time_efficiency", 3) * 1.5
+
+        # Per-place score (preference, distance, crowd, time efficiency)
+        delta += self.score_place(place, req, distance_km, current_time)
+
+        # Logical sequence bonus
+        if prev_place is not None and (prev_place.type_lower, place.type_lower) in self._logical_map:
+            delta += self.WEIGHTS["logical_sequence"]
+
+        # Per-edge share of the total-distance efficiency penalty
+        delta -= distance_km * abs(self.WEIGHTS.get("distance_penalty", -2))
+
+        return delta
+
+    def best_sequence(self, candidates: List[str], graph: Graph, req: Request,
+                      k: int, is_fallback: bool = False) -> Optional[Tuple[List[str], float]]:
+        """
+        Find the highest-scoring valid sequence of exactly k candidates using
+        dynamic programming over (visited-set, last-place) states instead of
+        enumerating all k! orderings.
+
+        Extending a partial sequence depends only on the last place and the
+        departure time, so each (bitmask, last) state keeps the Pareto-optimal
+        (elapsed time, score) pairs: a partial ordering is dropped only when
+        another ordering of the same set ending at the same place is at least
+        as fast AND scores at least as well. Partial sequences that already
+        exceed the time budget (plus the fallback tolerance) are pruned, and
+        branch-and-bound style, so are partials whose admissible upper bound
+        (current score plus the best possible per-step gain for each
+        remaining step) cannot beat the best completed sequence so far.
+
+        Returns (sequence, score) for the best valid sequence, or None.
+        """
+        n = len(candidates)
+        if k < 1 or k > n:
+            return None
+
+        start_time_minutes = req.start_time_minutes
+        time_available = req.time_available_minutes
+        time_tolerance = time_available * 0.05 if is_fallback else 0  # 5% tolerance in fallback
+        deadline = time_available + time_tolerance
+
+        nodes = graph.nodes
+        places = [nodes[place_id] for place_id in candidates]
+
+        # Hard avoid constraint (skipped in fallback mode, as in is_sequence_valid)
+        avoid_crowded = not is_fallback and req.avoid_crowded
+        usable = [not (avoid_crowded and place.crowd_level == "high") for place in places]
+
+        # Flatten per-candidate data into parallel lists indexed by candidate
+        # number, so the DP inner loop reads locals instead of chasing dicts
+        # and attributes for every extension. Distances and travel times come
+        # from the graph's dense matrices via the candidates' integer ids.
+        idxs = [graph.node_index[place_id] for place_id in candidates]
+        start_dist = [graph.dist_km[0][j] for j in idxs]
+        start_travel = [graph.travel_min[0][j] for j in idxs]
+        dist = [[graph.dist_km[idxs[i]][j] for j in idxs] for i in range(n)]
+        travel = [[graph.travel_min[idxs[i]][j] for j in idxs] for i in range(n)]
+        open_from = [place.open_from_min for place in places]
+        open_span = [place.open_span_min for place in places]
+        durations = [place.avg_duration_minutes for place in places]
+
+        # Admissible per-step gain bound for branch-and-bound pruning: each
+        # extension's delta is at most the sum of the best case of every
+        # positive scoring term (distance terms only ever subtract). Any
+        # partial whose score plus remaining steps times this bound stays
+        # below the best completed score cannot win and is not extended.
+        weights = self.WEIGHTS
+        w_time = weights.get("time_efficiency", 3)
+        w_crowd = weights["crowd_penalty"]
+        max_step_gain = (max(0.0, w_time * 1.5) +
+                         max(0.0, weights["preference_match"]) +
+                         max(0.0, w_crowd, abs(w_crowd) * 0.5) +
+                         max(0.0, w_time) +
+                         max(0.0, weights["logical_sequence"]))
+        best_full_score = None
+
+        # states[(mask, last)] = list of Pareto-optimal (elapsed, score, sequence)
+        states: Dict[Tuple[int, int], List[Tuple[float, float, Tuple[int, ...]]]] = {}
+
+        def add_state(key, elapsed, score, seq):
+            nonlocal best_full_score
+            if len(seq) == k and (best_full_score is None or score > best_full_score):
+                best_full_score = score
+            bucket = states.get(key)
+            if bucket is None:
+                states[key] = [(elapsed, score, seq)]
+                return
+            for other_elapsed, other_score, _ in bucket:
+                if other_elapsed <= elapsed and other_score >= score:
+                    return  # dominated by an existing state
+            bucket[:] = [s for s in bucket if not (elapsed <= s[0] and score >= s[1])]
+            bucket.append((elapsed, score, seq))
+
+        # Seed with every usable first place
+        for i in range(n):
+            if not usable[i]:
+                continue
+            arrival = start_time_minutes + start_travel[i]
+            if (int(arrival) - open_from[i]) % 1440 > open_span[i]:
+                continue
+            elapsed = arrival + durations[i] - start_time_minutes
+            if elapsed > deadline:
+                continue
+            score = self._score_step(None, places[i], start_dist[i], start_travel[i],
+                                     start_time_minutes, req)
+            add_state((1 << i, i), elapsed, score, (i,))
+
+        # Expand masks in increasing numeric order; every extension has a
+        # strictly larger mask, so each state is complete when visited
+        if k > 1:
+            for mask in range(1, 1 << n):
+                picked = bin(mask).count("1")
+                if picked >= k:
+                    continue
+                remaining_gain = (k - picked) * max_step_gain
+                for last in range(n):
+                    bucket = states.get((mask, last))
+                    if not bucket:
+                        continue
+                    prev_place = places[last]
+                    prev_dist = dist[last]
+                    prev_travel = travel[last]
+                    for i in range(n):
+                        bit = 1 << i
+                        if mask & bit or not usable[i]:
+                            continue
+                        leg_travel = prev_travel[i]
+                        for elapsed, score, seq in list(bucket):
+                            # Bound check: even best-case remaining steps
+                            # cannot beat an already-completed sequence
+                            if (best_full_score is not None and
+                                    score + remaining_gain < best_full_score):
+                                continue
+                            current_time = start_time_minutes + elapsed
+                            arrival = current_time + leg_travel
+                            if (int(arrival) - open_from[i]) % 1440 > open_span[i]:
+                                continue
+                            new_elapsed = arrival + durations[i] - start_time_minutes
+                            if new_elapsed > deadline:
+                                continue
+                            delta = self._score_step(prev_place, places[i], prev_dist[i],
+                                                     leg_travel, current_time, req)
+                            add_state((mask | bit, i), new_elapsed, score + delta, seq + (i,))
+
+        # Pick the best full-length state
+        best_seq = None
+        best_score = 0.0
+        for (mask, last), bucket in states.items():
+            if bin(mask).count("1") != k:
+                continue
+            for elapsed, score, seq in bucket:
+                if best_seq is None or score > best_score:
+                    best_seq = seq
+                    best_score = score
+
+        if best_seq is None:
+            return None
+        return [candidates[i] for i in best_seq], best_score
+
     def find_best_sequence(self, candidates: List[str], graph: Graph, is_fallback: bool = False) -> SequenceResult:
         """
         Step 2: From candidate places, decide sequence based on current time and distance.
@@ -730,9 +1077,16 @@ class Engine:
         Returns:
             SequenceResult with best sequence
         """
-        user_data = graph.user_data
-        start_time_minutes = self.time_to_minutes(user_data.get("start_time", "00:00"))
-        
+        # Public entry point, so it cannot trust cache state left behind by
+        # an earlier request: the sequence caches key on bare sequence
+        # tuples, which is only sound once they are cleared for this graph
+        # and request. Redundant (but harmless) for the call from process(),
+        # which clears them and caches nothing before delegating here.
+        self._valid_cache.clear()
+        self._score_cache.clear()
+
+        req = self._compile_request(graph)
+
         if len(candidates) < 2:
             # Not enough candidates
             if len(candidates) == 1:
@@ -745,60 +1099,47 @@ class Engine:
                     explanation={"error": "No valid places found matching constraints"}
                 )
         
-        # Generate ALL valid sequences and score them with weights
-        scored_sequences = []  # List of (sequence, score) tuples
-        
-        # Generate sequences of length 2
-        for seq in permutations(candidates, min(2, len(candidates))):
-            seq_list = list(seq)
-            is_valid, error = self.is_sequence_valid(seq_list, graph, user_data, is_fallback=is_fallback)
-            if is_valid:
-                # Score this sequence using our weights
-                score = self.score_sequence(seq_list, graph, user_data)
-                scored_sequences.append((seq_list, score))
-        
-        # Generate sequences of length 3
-        if len(candidates) >= 3:
-            for seq in permutations(candidates, 3):
-                seq_list = list(seq)
-                is_valid, error = self.is_sequence_valid(seq_list, graph, user_data, is_fallback=is_fallback)
-                if is_valid:
-                    # Score this sequence using our weights
-                    score = self.score_sequence(seq_list, graph, user_data)
-                    scored_sequences.append((seq_list, score))
-        
+        # Find the best sequence of each target length via the DP search.
+        # Higher score wins; ties go to the shorter sequence, matching the old
+        # stable sort over length-2-then-length-3 enumeration. The winner is
+        # re-scored with score_sequence so the reported score is bit-identical
+        # to the enumeration-based one.
+        best = None  # (sequence, score)
+        for seq_len in (min(2, len(candidates)), 3):
+            if len(candidates) < seq_len:
+                continue
+            found = self.best_sequence(candidates, graph, req, seq_len, is_fallback=is_fallback)
+            if found is not None:
+                score = self._score_sequence_cached(found[0], graph, req)
+                if best is None or score > best[1]:
+                    best = (found[0], score)
+
         # If no valid sequences found, try shorter sequences as fallback
-        if not scored_sequences:
-            for seq_len in [2, 1]:
+        if best is None:
+            for seq_len in (2, 1):
                 if len(candidates) >= seq_len:
-                    for seq in permutations(candidates, seq_len):
-                        seq_list = list(seq)
-                        is_valid, error = self.is_sequence_valid(seq_list, graph, user_data, is_fallback=is_fallback)
-                        if is_valid:
-                            score = self.score_sequence(seq_list, graph, user_data)
-                            scored_sequences.append((seq_list, score))
-                    if scored_sequences:
+                    found = self.best_sequence(candidates, graph, req, seq_len, is_fallback=is_fallback)
+                    if found is not None:
+                        best = (found[0], self._score_sequence_cached(found[0], graph, req))
                         break
-        
+
         # If still no valid sequences, return error
-        if not scored_sequences:
+        if best is None:
             return SequenceResult(
                 sequence=[],
                 total_time_minutes=0,
                 explanation={"error": "No valid sequence found"}
             )
-        
-        # Sort all scored sequences by score (highest first)
-        scored_sequences.sort(key=lambda x: x[1], reverse=True)
-        
+
         # Get the best sequence (highest score)
-        best_sequence, best_score = scored_sequences[0]
-        
-        # Calculate total time for the best sequence
-        total_time, _ = self.calculate_sequence_time(best_sequence, graph, start_time_minutes)
+        best_sequence, best_score = best
         
-        # Generate explanations
-        explanations = self.generate_explanations(best_sequence, graph, user_data, is_fallback=is_fallback)
+        # Walk the winning sequence once; the trace covers both the total time
+        # and everything the explanations need
+        trace = self._trace_sequence(best_sequence, graph, req)
+        total_time = trace.total_time
+        explanations = self.generate_explanations(best_sequence, graph, req,
+                                                  is_fallback=is_fallback, trace=trace)
         
         # Add score to explanation for debugging/transparency
         explanations["_score"] = f"{best_score:.2f}"
@@ -809,6 +1150,49 @@ class Engine:
             explanation=explanations
         )
     
+    def _enumerate_and_score(self, candidates: List[str], graph: Graph, req: Request,
+                             is_fallback: bool = False) -> List[Tuple[List[str], float]]:
+        """
+        Enumerate and score every valid sequence of candidates: lengths 2 and
+        3 first, then shorter sequences (2, then 1) only if nothing longer is
+        valid. Returns unsorted (sequence, score) pairs.
+
+        Permutation tuples flow through validation and scoring as-is (both
+        only iterate, and the sequence caches key on tuples anyway); a list
+        is materialized only for sequences that survive validation, since
+        callers expect lists in the returned pairs.
+        """
+        scored_sequences = []
+
+        # Sequences of length 2
+        for seq in permutations(candidates, min(2, len(candidates))):
+            is_valid, error = self._is_sequence_valid_cached(seq, graph, req, is_fallback=is_fallback)
+            if is_valid:
+                score = self._score_sequence_cached(seq, graph, req)
+                scored_sequences.append((list(seq), score))
+
+        # Sequences of length 3
+        if len(candidates) >= 3:
+            for seq in permutations(candidates, 3):
+                is_valid, error = self._is_sequence_valid_cached(seq, graph, req, is_fallback=is_fallback)
+                if is_valid:
+                    score = self._score_sequence_cached(seq, graph, req)
+                    scored_sequences.append((list(seq), score))
+
+        # Fallback for shorter sequences
+        if not scored_sequences:
+            for seq_len in [2, 1]:
+                if len(candidates) >= seq_len:
+                    for seq in permutations(candidates, seq_len):
+                        is_valid, error = self._is_sequence_valid_cached(seq, graph, req, is_fallback=is_fallback)
+                        if is_valid:
+                            score = self._score_sequence_cached(seq, graph, req)
+                            scored_sequences.append((list(seq), score))
+                    if scored_sequences:
+                        break
+
+        return scored_sequences
+
     def process(self, graph: Graph) -> SequenceResult:
         """
         Main processing function: selects 2-3 places and determines optimal sequence.
@@ -819,6 +1203,15 @@ class Engine:
         
         Fallback: If no candidates found with strict constraints, relax avoid list
         """
+        cache_key = ("process", self._graph_digest(graph))
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Sequence caches are per-request (they bake in the user constraints)
+        self._valid_cache.clear()
+        self._score_cache.clear()
+
         # Phase 1: Filter candidates (try strict first)
         candidates, is_fallback = self.filter_candidates(graph, strict_avoid=True)
         
@@ -828,6 +1221,7 @@ class Engine:
         
         # Phase 2: Find best sequence from candidates
         result = self.find_best_sequence(candidates, graph, is_fallback=is_fallback)
+        self._result_cache[cache_key] = result
         return result
     
     def process_with_all_scores(self, graph: Graph) -> Tuple[SequenceResult, List[Tuple[List[str], float]]]:
@@ -837,7 +1231,22 @@ class Engine:
         
         Returns:
             (best_result, all_scored_sequences)
+
+        The scored-sequences list is freshly built per call (cache hits get a
+        shallow copy), so callers may sort or extend it. The SequenceResult
+        and the inner (sequence, score) pairs are shared with the cache and
+        should be treated as read-only.
         """
+        cache_key = ("all_scores", self._graph_digest(graph))
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            best_result, scored_sequences = cached
+            return best_result, list(scored_sequences)
+
+        # Sequence caches are per-request (they bake in the user constraints)
+        self._valid_cache.clear()
+        self._score_cache.clear()
+
         # Phase 1: Filter candidates (try strict first)
         candidates, is_fallback = self.filter_candidates(graph, strict_avoid=True)
         
@@ -849,68 +1258,36 @@ class Engine:
             if len(candidates) == 1:
                 sequence = candidates
             else:
-                sequence = []
-                return (
-                    SequenceResult(
-                        sequence=sequence,
-                        total_time_minutes=0,
-                        explanation={"error": "No valid places found matching constraints"}
-                    ),
-                    []
+                best_result = SequenceResult(
+                    sequence=[],
+                    total_time_minutes=0,
+                    explanation={"error": "No valid places found matching constraints"}
                 )
+                self._result_cache[cache_key] = (best_result, [])
+                return best_result, []
         
         # Phase 2: Generate and score all sequences
-        user_data = graph.user_data
-        scored_sequences = []
-        
-        # Sequences of length 2
-        for seq in permutations(candidates, min(2, len(candidates))):
-            seq_list = list(seq)
-            is_valid, error = self.is_sequence_valid(seq_list, graph, user_data, is_fallback=is_fallback)
-            if is_valid:
-                score = self.score_sequence(seq_list, graph, user_data)
-                scored_sequences.append((seq_list, score))
-        
-        # Sequences of length 3
-        if len(candidates) >= 3:
-            for seq in permutations(candidates, 3):
-                seq_list = list(seq)
-                is_valid, error = self.is_sequence_valid(seq_list, graph, user_data, is_fallback=is_fallback)
-                if is_valid:
-                    score = self.score_sequence(seq_list, graph, user_data)
-                    scored_sequences.append((seq_list, score))
-        
-        # Fallback for shorter sequences
-        if not scored_sequences:
-            for seq_len in [2, 1]:
-                if len(candidates) >= seq_len:
-                    for seq in permutations(candidates, seq_len):
-                        seq_list = list(seq)
-                        is_valid, error = self.is_sequence_valid(seq_list, graph, user_data, is_fallback=is_fallback)
-                        if is_valid:
-                            score = self.score_sequence(seq_list, graph, user_data)
-                            scored_sequences.append((seq_list, score))
-                    if scored_sequences:
-                        break
-        
+        req = self._compile_request(graph)
+        scored_sequences = self._enumerate_and_score(candidates, graph, req, is_fallback)
+
         if not scored_sequences:
-            return (
-                SequenceResult(
-                    sequence=[],
-                    total_time_minutes=0,
-                    explanation={"error": "No valid sequence found"}
-                ),
-                []
+            best_result = SequenceResult(
+                sequence=[],
+                total_time_minutes=0,
+                explanation={"error": "No valid sequence found"}
             )
+            self._result_cache[cache_key] = (best_result, [])
+            return best_result, []
         
         # Sort by score (highest first)
         scored_sequences.sort(key=lambda x: x[1], reverse=True)
         
-        # Get best sequence
+        # Get best sequence; one trace walk covers total time and explanations
         best_sequence, best_score = scored_sequences[0]
-        start_time_minutes = self.time_to_minutes(graph.user_data.get("start_time", "00:00"))
-        total_time, _ = self.calculate_sequence_time(best_sequence, graph, start_time_minutes)
-        explanations = self.generate_explanations(best_sequence, graph, graph.user_data, is_fallback=is_fallback)
+        trace = self._trace_sequence(best_sequence, graph, req)
+        total_time = trace.total_time
+        explanations = self.generate_explanations(best_sequence, graph, req,
+                                                  is_fallback=is_fallback, trace=trace)
         explanations["_score"] = f"{best_score:.2f}"
         
         best_result = SequenceResult(
@@ -918,6 +1295,7 @@ class Engine:
             total_time_minutes=round(total_time, 1),
             explanation=explanations
         )
-        
-        return best_result, scored_sequences
+
+        self._result_cache[cache_key] = (best_result, scored_sequences)
+        return best_result, list(scored_sequences)
 
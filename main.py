@@ -1,7 +1,7 @@
 from preprocessor import Preprocessor
 from engine import Engine
+import argparse
 import json
-import sys
 
 
 def process_input(input_file: str, output_file: str = None, verbose: bool = False, weights_file: str = None):
@@ -57,28 +57,16 @@ def process_input(input_file: str, output_file: str = None, verbose: bool = Fals
 
 
 if __name__ == "__main__":
-    # Parse arguments
-    verbose = "--verbose" in sys.argv or "-v" in sys.argv
-    
-    # Parse weights file
-    weights_file = None
-    if "--weights" in sys.argv:
-        idx = sys.argv.index("--weights")
-        if idx + 1 < len(sys.argv):
-            weights_file = sys.argv[idx + 1]
-    
-    # Filter out flags
-    args = [arg for arg in sys.argv[1:] 
-            if arg not in ["--verbose", "-v", "--weights"] and 
-            (sys.argv.index(arg) == 0 or sys.argv[sys.argv.index(arg) - 1] != "--weights")]
-    
-    # Default to first test file if no argument provided
-    if len(args) > 0:
-        input_file = args[0]
-    else:
-        input_file = "test_inputs/test1_basic.json"
-    
-    # Second argument is output file (if not a flag)
-    output_file = args[1] if len(args) > 1 and not args[1].startswith("-") else None
-    
-    process_input(input_file, output_file, verbose, weights_file)
+    # Parse arguments (single linear pass; no repeated sys.argv scans)
+    parser = argparse.ArgumentParser(description="Process an input JSON file and generate a sequence")
+    parser.add_argument("input_file", nargs="?", default="test_inputs/test1_basic.json",
+                        help="input JSON file (default: test_inputs/test1_basic.json)")
+    parser.add_argument("output_file", nargs="?", default=None,
+                        help="output JSON file (default: print to stdout)")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="show detailed processing information")
+    parser.add_argument("--weights", default=None,
+                        help="weights file name or path (default: default.json)")
+    args = parser.parse_args()
+
+    process_input(args.input_file, args.output_file, args.verbose, args.weights)
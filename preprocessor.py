@@ -1,10 +1,30 @@
 import json
 import math
+from functools import lru_cache
+
+# orjson parses JSON several times faster than the stdlib; fall back to
+# json transparently when it isn't installed (mirrors engine.py)
+try:
+    import orjson as _fast_json
+except ImportError:
+    _fast_json = None
 from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+
+@lru_cache(maxsize=4096)
+def time_to_minutes(time_str: str) -> int:
+    """Convert time string (HH:MM) to minutes since midnight"""
+    try:
+        # Fixed HH:MM layout: slicing skips the split + map machinery
+        return int(time_str[:2]) * 60 + int(time_str[3:])
+    except ValueError:
+        # Tolerate H:MM and similar variants the old parser accepted
+        hours, minutes = map(int, time_str.split(":"))
+        return hours * 60 + minutes
 
 
-@dataclass
+@dataclass(slots=True)
 class PlaceNode:
     """Represents a place as a node in the graph"""
     id: str
@@ -16,9 +36,31 @@ class PlaceNode:
     crowd_level: str
     open_from: str
     open_to: str
+    # Precomputed from open_from/open_to so hot paths compare ints instead of
+    # re-parsing HH:MM strings on every opening-hours check
+    open_from_min: int = field(init=False)
+    open_to_min: int = field(init=False)
+    # Window length on the 1440-minute ring; lets the opening check be the
+    # single branchless compare (t - open_from_min) % 1440 <= open_span_min,
+    # which handles overnight windows without a special case
+    open_span_min: int = field(init=False)
+    # Lowercased type, computed once so hot loops don't allocate new strings
+    type_lower: str = field(init=False)
+    # Interned integer code for type_lower (see Preprocessor.type_vocab);
+    # grouping by type hashes a small int instead of a string
+    type_code: int = field(init=False, default=-1)
+    # Dense integer id assigned by the preprocessor (row into the graph's
+    # distance/travel matrices); -1 until the node is attached to a graph
+    int_id: int = field(init=False, default=-1)
 
+    def __post_init__(self):
+        self.open_from_min = time_to_minutes(self.open_from)
+        self.open_to_min = time_to_minutes(self.open_to)
+        self.open_span_min = (self.open_to_min - self.open_from_min) % 1440
+        self.type_lower = self.type.lower()
 
-@dataclass
+
+@dataclass(slots=True)
 class Edge:
     """Represents an edge between two places with distance and travel time"""
     from_node: str
@@ -27,13 +69,97 @@ class Edge:
     travel_time_minutes: float
 
 
-@dataclass
+class _LazyEdgeStore:
+    """
+    Backing store for the edges/adjacency views: materializes one node's
+    outgoing Edge objects on first access from the distance/travel matrices,
+    so the fully-connected N^2 Edge population is never built eagerly.
+    """
+    __slots__ = ("node_ids", "node_index", "dist_km", "travel_min", "_rows")
+
+    def __init__(self, node_ids: List[str], node_index: Dict[str, int],
+                 dist_km: List[List[float]], travel_min: List[List[float]]):
+        self.node_ids = node_ids
+        self.node_index = node_index
+        self.dist_km = dist_km
+        self.travel_min = travel_min
+        self._rows: Dict[str, Tuple[List[Edge], Dict[str, Edge]]] = {}
+
+    def row(self, from_id: str) -> Tuple[List[Edge], Dict[str, Edge]]:
+        row = self._rows.get(from_id)
+        if row is None:
+            i = self.node_index[from_id]  # KeyError for unknown ids, like a dict
+            dist_row = self.dist_km[i]
+            travel_row = self.travel_min[i]
+            edge_list = [
+                Edge(
+                    from_node=from_id,
+                    to_node=to_id,
+                    distance_km=dist_row[j],
+                    travel_time_minutes=travel_row[j]
+                )
+                for j, to_id in enumerate(self.node_ids)
+                if j != i  # No self-loops
+            ]
+            row = (edge_list, {edge.to_node: edge for edge in edge_list})
+            self._rows[from_id] = row
+        return row
+
+
+class _LazyEdgeView:
+    """Read-only dict-like view over a _LazyEdgeStore (one entry per node)"""
+    __slots__ = ("_store", "_part")
+
+    def __init__(self, store: _LazyEdgeStore, part: int):
+        self._store = store
+        self._part = part  # 0 -> [Edge] lists, 1 -> {to_id: Edge} maps
+
+    def __getitem__(self, from_id: str):
+        return self._store.row(from_id)[self._part]
+
+    def __contains__(self, from_id) -> bool:
+        return from_id in self._store.node_index
+
+    def __iter__(self):
+        return iter(self._store.node_ids)
+
+    def __len__(self) -> int:
+        return len(self._store.node_ids)
+
+    def keys(self):
+        return self._store.node_index.keys()
+
+    def items(self):
+        return ((from_id, self[from_id]) for from_id in self._store.node_ids)
+
+    def get(self, from_id, default=None):
+        return self[from_id] if from_id in self._store.node_index else default
+
+
+@dataclass(slots=True)
 class Graph:
     """Graph representation of places and their connections"""
     nodes: Dict[str, PlaceNode]  # place_id -> PlaceNode
-    edges: Dict[str, List[Edge]]  # from_node_id -> [Edge]
+    edges: _LazyEdgeView  # from_node_id -> [Edge], materialized on demand
+    adjacency: _LazyEdgeView  # from_node_id -> to_node_id -> Edge, materialized on demand
     start_node: PlaceNode  # Starting location as a node
     user_data: Dict  # Original user data (preferences, avoid, etc.)
+    node_ids: List[str]  # int_id -> place_id ("start" is always index 0)
+    node_index: Dict[str, int]  # place_id -> int_id
+    dist_km: List[List[float]]  # dense distance matrix indexed by int_id
+    travel_min: List[List[float]]  # dense travel-time matrix indexed by int_id
+    start_time_min: int  # user's start_time parsed once ("00:00" when absent)
+    travel_from_start: List[float]  # row 0 of travel_min (shared reference, not a copy)
+
+    def edge_metrics(self, from_id: str, to_id: str) -> Tuple[float, float]:
+        """(distance_km, travel_time_minutes) between two nodes by id.
+
+        One-off matrix lookup for callers outside the hot loops; tight loops
+        should index the dist_km/travel_min rows directly via int_id.
+        """
+        i = self.node_index[from_id]
+        j = self.node_index[to_id]
+        return self.dist_km[i][j], self.travel_min[i][j]
 
 
 class Preprocessor:
@@ -42,6 +168,9 @@ class Preprocessor:
         self.WALKING_SPEED_KMH = 5.0
         # Earth's radius in kilometers
         self.EARTH_RADIUS_KM = 6371.0
+        # Interning table for place types: type_lower -> small int code,
+        # shared across every graph this preprocessor builds
+        self.type_vocab: Dict[str, int] = {}
 
     def haversine_distance(self, lat1: float, lng1: float, lat2: float, lng2: float) -> float:
         """
@@ -78,7 +207,7 @@ class Preprocessor:
 
     def create_start_node(self, user_lat: float, user_lng: float) -> PlaceNode:
         """Create a node representing the starting location"""
-        return PlaceNode(
+        node = PlaceNode(
             id="start",
             name="Starting Location",
             type="start",
@@ -89,6 +218,17 @@ class Preprocessor:
             open_from="00:00",
             open_to="23:59"
         )
+        node.type_code = self.intern_type(node.type_lower)
+        return node
+
+    def intern_type(self, type_lower: str) -> int:
+        """Integer code for a lowercased place type, assigned on first sight"""
+        vocab = self.type_vocab
+        code = vocab.get(type_lower)
+        if code is None:
+            code = len(vocab)
+            vocab[type_lower] = code
+        return code
 
     def create_place_nodes(self, places: List[Dict]) -> Dict[str, PlaceNode]:
         """Create PlaceNode objects from place data"""
@@ -105,37 +245,47 @@ class Preprocessor:
                 open_from=place["open_from"],
                 open_to=place["open_to"]
             )
+            node.type_code = self.intern_type(node.type_lower)
             nodes[place["id"]] = node
         return nodes
 
-    def create_edges(self, nodes: Dict[str, PlaceNode], start_node: PlaceNode) -> Dict[str, List[Edge]]:
+    def compute_distance_matrices(self, ordered_nodes: List[PlaceNode]) -> Tuple[List[List[float]], List[List[float]]]:
         """
-        Create edges between all nodes (fully connected graph).
-        Each edge represents the distance and travel time between two places.
+        Compute the full pairwise distance and travel-time matrices for the
+        given nodes (row/column i corresponds to ordered_nodes[i]).
+
+        One batch pass instead of N^2 haversine_distance calls: the radians
+        conversions and cos(lat) terms are computed once per node rather than
+        once per pair, math.* functions are bound to locals, and the matrices
+        are filled symmetrically so each pair's transcendentals run once.
         """
-        edges = {}
-        all_nodes = {"start": start_node, **nodes}
-        
-        # Create edges from each node to every other node
-        for from_id, from_node in all_nodes.items():
-            edges[from_id] = []
-            for to_id, to_node in all_nodes.items():
-                if from_id != to_id:  # No self-loops
-                    distance_km = self.haversine_distance(
-                        from_node.lat, from_node.lng,
-                        to_node.lat, to_node.lng
-                    )
-                    travel_time_minutes = self.distance_to_travel_time(distance_km)
-                    
-                    edge = Edge(
-                        from_node=from_id,
-                        to_node=to_id,
-                        distance_km=distance_km,
-                        travel_time_minutes=travel_time_minutes
-                    )
-                    edges[from_id].append(edge)
-        
-        return edges
+        n = len(ordered_nodes)
+        sin, cos, asin, sqrt = math.sin, math.cos, math.asin, math.sqrt
+        lat_rad = [math.radians(node.lat) for node in ordered_nodes]
+        lng_rad = [math.radians(node.lng) for node in ordered_nodes]
+        cos_lat = [cos(v) for v in lat_rad]
+
+        radius_x2 = 2.0 * self.EARTH_RADIUS_KM
+        speed_kmh = self.WALKING_SPEED_KMH
+
+        dist_km = [[0.0] * n for _ in range(n)]
+        travel_min = [[0.0] * n for _ in range(n)]
+        for i in range(n):
+            lat_i, lng_i, cos_i = lat_rad[i], lng_rad[i], cos_lat[i]
+            dist_row, travel_row = dist_km[i], travel_min[i]
+            for j in range(i + 1, n):
+                # * 0.5 rounds identically to / 2 (exact power-of-two scale)
+                # but skips the slower float division in the inner loop
+                a = (sin((lat_rad[j] - lat_i) * 0.5) ** 2 +
+                     cos_i * cos_lat[j] * sin((lng_rad[j] - lng_i) * 0.5) ** 2)
+                distance = radius_x2 * asin(sqrt(a))
+                travel = distance / speed_kmh * 60
+                dist_row[j] = distance
+                travel_row[j] = travel
+                dist_km[j][i] = distance
+                travel_min[j][i] = travel
+
+        return dist_km, travel_min
 
     def preprocess(self, data: Dict) -> Graph:
         """
@@ -156,22 +306,44 @@ class Preprocessor:
         
         # Create place nodes
         nodes = self.create_place_nodes(places)
-        
-        # Create edges (fully connected graph)
-        edges = self.create_edges(nodes, start_node)
-        
+
+        # Integer-encode node ids (start is row 0); the dense matrices and
+        # the per-node int_ids both key off this ordering
+        node_ids = ["start"] + list(nodes)
+        node_index = {}
+        ordered_nodes = [start_node] + list(nodes.values())
+        for int_id, node_id in enumerate(node_ids):
+            node_index[node_id] = int_id
+            ordered_nodes[int_id].int_id = int_id
+
+        # Batch-compute the pairwise distance/travel matrices. Edge objects
+        # are not built here: the edges/adjacency views materialize a node's
+        # row from the matrices on first access, and the engine's hot paths
+        # read the matrices directly without touching Edge at all
+        dist_km, travel_min = self.compute_distance_matrices(ordered_nodes)
+        edge_store = _LazyEdgeStore(node_ids, node_index, dist_km, travel_min)
+
         # Create and return graph
         graph = Graph(
             nodes=nodes,
-            edges=edges,
+            edges=_LazyEdgeView(edge_store, 0),
+            adjacency=_LazyEdgeView(edge_store, 1),
             start_node=start_node,
-            user_data=user
+            user_data=user,
+            node_ids=node_ids,
+            node_index=node_index,
+            dist_km=dist_km,
+            travel_min=travel_min,
+            start_time_min=time_to_minutes(user.get("start_time", "00:00")),
+            travel_from_start=travel_min[0]
         )
         
         return graph
 
     def preprocess_from_file(self, filepath: str) -> Graph:
         """Load JSON from file and preprocess into graph"""
-        with open(filepath, 'r') as f:
-            data = json.load(f)
+        # Read bytes and parse in one shot; text-mode json.load is slower
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        data = _fast_json.loads(raw) if _fast_json is not None else json.loads(raw)
         return self.preprocess(data)
\ No newline at end of file
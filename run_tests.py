@@ -6,13 +6,16 @@ import glob
 from pathlib import Path
 
 
-def run_single_test(test_file: str, show_all_scores: bool = False) -> dict:
+def run_single_test(test_file: str, show_all_scores: bool = False,
+                    preprocessor: Preprocessor = None, engine: Engine = None) -> dict:
     """
     Run a single test file and return results.
     
     Args:
         test_file: Path to test JSON file
         show_all_scores: If True, show all scored sequences
+        preprocessor: Optional shared Preprocessor (created if omitted)
+        engine: Optional shared Engine (created if omitted)
         
     Returns:
         Dictionary with test results
@@ -22,9 +25,11 @@ def run_single_test(test_file: str, show_all_scores: bool = False) -> dict:
     print("=" * 80)
     
     try:
-        # Initialize components
-        preprocessor = Preprocessor()
-        engine = Engine()
+        # Initialize components unless shared instances were passed in
+        if preprocessor is None:
+            preprocessor = Preprocessor()
+        if engine is None:
+            engine = Engine()
         
         # Load and preprocess
         graph = preprocessor.preprocess_from_file(test_file)
@@ -133,9 +138,14 @@ def run_all_tests(test_dir: str = "test_inputs", show_all_scores: bool = False):
     failed_count = 0
     error_count = 0
     
+    # One Preprocessor/Engine pair for the whole run: config files load
+    # once and the engine-level caches stay warm across test files
+    preprocessor = Preprocessor()
+    engine = Engine()
+    
     # Run each test
     for test_file in test_files:
-        result = run_single_test(test_file, show_all_scores)
+        result = run_single_test(test_file, show_all_scores, preprocessor, engine)
         results.append(result)
         
         if result["status"] == "success":